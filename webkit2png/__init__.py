@@ -1,2 +1,25 @@
-from webkit2png import WebkitRenderer
-__all__ = ['WebkitRenderer']
\ No newline at end of file
+import sys
+from types import ModuleType
+
+__all__ = ['WebkitRenderer', 'ChangeIndex']
+
+# The classes (and the webkit2png.webkit2png module itself) are imported
+# on first access, so that importing webkit2png.scripts does not load
+# PyQt4 and QtWebKit.
+class _LazyModule(ModuleType):
+    def __getattr__(self, name):
+        if name not in __all__ and name != 'webkit2png':
+            raise AttributeError("module %r has no attribute %r" % (self.__name__, name))
+        module = __import__(self.__name__ + '.webkit2png', None, None, ['__name__'], 0)
+        if name == 'webkit2png':
+            return module
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+# Keep a reference to the original module, whose globals would
+# otherwise be cleared when it is garbage collected.
+_module = sys.modules[__name__]
+_lazy = sys.modules[__name__] = _LazyModule(__name__)
+_lazy.__dict__.update(_module.__dict__)
+_lazy._module = _module
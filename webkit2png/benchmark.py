@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# benchmark.py
+#
+# Measures the startup latency of the webkit2png command line tool.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import sys
+import os
+import time
+import pipes
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+COMMAND = [sys.executable, '-m', 'webkit2png.scripts']
+
+def _run(args):
+    """Runs webkit2png with the given args and returns the elapsed time."""
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(COMMAND + args, stdout=devnull)
+    return time.time() - start
+
+def check_lazy_imports():
+    """
+    Raises a RuntimeError if importing the command line script loads
+    PyQt4, which would make --help and option errors as slow as a render.
+    """
+    code = "import sys, webkit2png.scripts; " \
+         + "sys.exit([m for m in sys.modules if m.startswith('PyQt4')] and 1 or 0)"
+    if subprocess.call([sys.executable, '-c', code]) != 0:
+        raise RuntimeError("Importing webkit2png.scripts loads PyQt4")
+
+def measure_help(runs):
+    """Time of 'webkit2png --help', which must not load Qt or WebKit."""
+    check_lazy_imports()
+    return [_run(['--help']) for i in range(runs)]
+
+def measure_cold(runs, args):
+    """Time of a complete run that renders a single page."""
+    return [_run(args) for i in range(runs)]
+
+def measure_zygote(runs, args):
+    """
+    Time from sending a request to a running zygote (see --zygote)
+    until it has been rendered. The zygote is warmed up by one
+    request that is not measured.
+    """
+    zygote = subprocess.Popen(COMMAND + ['--zygote'],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    request = " ".join(pipes.quote(arg) for arg in args) + "\n"
+    times = []
+    try:
+        for i in range(runs + 1):
+            start = time.time()
+            zygote.stdin.write(request)
+            zygote.stdin.flush()
+            status = zygote.stdout.readline()
+            if not status.startswith("0 "):
+                raise RuntimeError("Zygote request failed: %s" % status.strip())
+            if i > 0:
+                times.append(time.time() - start)
+    finally:
+        zygote.stdin.close()
+        zygote.wait()
+    return times
+
+def _report(name, times):
+    times = sorted(times)
+    print "%-8s min %8.1f ms   median %8.1f ms   max %8.1f ms" % (name,
+        times[0] * 1000, times[len(times) // 2] * 1000, times[-1] * 1000)
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [URL]",
+                          description="Measures the startup latency of webkit2png. "
+                          + "A page is rendered for each run, so an X server is required "
+                          + "(see -d). URL defaults to 'about:blank'.")
+    parser.add_option("-n", "--runs", dest="runs", default=5, type="int",
+                      help="Number of runs per measurement [default: %default]", metavar="RUNS")
+    parser.add_option("-d", "--display", dest="display",
+                      help="Connect to X server at DISPLAY.", metavar="DISPLAY")
+    (options, args) = parser.parse_args()
+    if len(args) > 1:
+        parser.error("incorrect number of arguments")
+    if options.runs < 1:
+        parser.error("RUNS must be at least 1")
+    url = args[0] if args else "about:blank"
+
+    (fd, output) = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    render_args = ["-o", output, url]
+    if options.display:
+        render_args = ["-d", options.display] + render_args
+
+    try:
+        _report("help", measure_help(options.runs))
+        _report("cold", measure_cold(options.runs, render_args))
+        _report("zygote", measure_zygote(options.runs, render_args))
+    finally:
+        os.remove(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,19 +24,16 @@
 #  - Add QTcpSocket support to create a "screenshot daemon" that
 #    can handle multiple requests at the same time.
 
-from webkit2png import WebkitRenderer
-
 import sys
 import signal
 import os
+import shlex
 import urlparse
 import logging
 from optparse import OptionParser
 
-from PyQt4.QtCore import *
-from PyQt4.QtGui import *
-from PyQt4.QtWebKit import *
-from PyQt4.QtNetwork import *
+# PyQt4 and QtWebKit are imported inside the functions that need them,
+# so that --help and invalid options are handled without loading WebKit.
 
 VERSION="20091224"
 LOG_FILENAME = 'webkit2png.log'
@@ -44,6 +41,8 @@ logger = logging.getLogger('webkit2png')
 
 def init_qtgui(display=None, style=None, qtargs=None):
     """Initiates the QApplication environment using the given args."""
+    from PyQt4.QtGui import QApplication
+
     if QApplication.instance():
         logger.debug("QApplication has already been instantiated. \
                         Ignoring given arguments and returning existing QApplication.")
@@ -67,15 +66,8 @@ def init_qtgui(display=None, style=None, qtargs=None):
     return QApplication(qtargs2)
 
 
-def main():
-    # This code will be executed if this module is run 'as-is'.
-
-    # Enable HTTP proxy
-    if 'http_proxy' in os.environ:
-        proxy_url = urlparse.urlparse(os.environ.get('http_proxy'))
-        proxy = QNetworkProxy(QNetworkProxy.HttpProxy, proxy_url.hostname, proxy_url.port)
-        QNetworkProxy.setApplicationProxy(proxy)
-
+def _option_parser():
+    """Returns the OptionParser for the command line arguments."""
     # Parse command line arguments.
     # Syntax:
     # $0 [--xvfb|--display=DISPLAY] [--debug] [--output=FILENAME] <URL>
@@ -117,20 +109,46 @@ def main():
                       help="Change the Qt look and feel to STYLE (e.G. 'windows').", metavar="STYLE")
     parser.add_option("", "--encoded-url", dest="encoded_url", action="store_true",
         help="Treat URL as url-encoded", metavar="ENCODED_URL", default=False)
+    parser.add_option("", "--change-index", dest="change_index",
+                      help="Keep a hash of each capture in FILE and only write the output if the page has changed. "
+                      + "Requires -o. Writes 'unchanged' or 'changed X Y WIDTH HEIGHT' (the bounding box "
+                      + "of the changed area) to STDERR.", metavar="FILE")
     parser.add_option("-d", "--display", dest="display",
                       help="Connect to X server at DISPLAY.", metavar="DISPLAY")
     parser.add_option("--debug", action="store_true", dest="debug",
                       help="Show debugging information.", default=False)
     parser.add_option("--log", action="store", dest="logfile", default=LOG_FILENAME,
                       help="Select the log output file",)
+    parser.add_option("", "--zygote", dest="zygote", action="store_true",
+                      help="Load the Qt and WebKit libraries once, then read requests from STDIN, one per line, "
+                      + "each given as the options and URL of a single run. Every request is rendered "
+                      + "in a forked child, which still creates its own QApplication and WebKit page, "
+                      + "so only the time for loading the libraries is saved. Requests must use -o "
+                      + "and can not use -x or --log. Options given here are the defaults "
+                      + "of each request. A line '<exit status> <request>' is written to STDOUT "
+                      + "when a request has finished.", default=False)
+    parser.add_option("", "--zygote-timeout", dest="zygote_timeout", default=300, type="int",
+                      help="Kill a zygote request that has not finished after SECONDS, "
+                      + "0 means no limit [default: %default]", metavar="SECONDS")
+    return parser
+
+def main():
+    # This code will be executed if this module is run 'as-is'.
+    parser = _option_parser()
 
     # Parse command line arguments and validate them (as far as we can)
     (options,args) = parser.parse_args()
-    if len(args) != 1:
+    if options.zygote:
+        if len(args) != 0:
+            parser.error("option --zygote takes no URL")
+    elif len(args) != 1:
         parser.error("incorrect number of arguments")
+    else:
+        options.url = args[0]
     if options.display and options.xvfb:
         parser.error("options -x and -d are mutually exclusive")
-    options.url = args[0]
+    if options.change_index and options.output is None and not options.zygote:
+        parser.error("option --change-index requires -o")
 
     logging.basicConfig(filename=options.logfile,level=logging.WARN,)
 
@@ -158,10 +176,117 @@ def main():
             print >> sys.stderr, "Error - Unable to find '%s' for -x/--xvfb option" % newArgs[0]
             sys.exit(1)
 
-    # Prepare output ("1" means STDOUT)
+    if options.zygote:
+        return _zygote(parser, options)
+    return _render(options)
+
+def _zygote(parser, options):
+    """
+    Serves the requests read from STDIN (see --zygote). The Qt and WebKit
+    libraries are loaded before the first fork, but a child still has to set
+    up its QApplication and WebKit page before rendering. The QApplication
+    is not shared, because its X11 connection can not be used by more
+    than one process.
+    """
+    # Load PyQt4 and QtWebKit into this process
+    from webkit2png import WebkitRenderer
+    logger.debug("Zygote ready")
+
+    status = 0
+    for line in iter(sys.stdin.readline, ''):
+        line = line.strip()
+        if not line:
+            continue
+
+        pid = os.fork()
+        if pid == 0:
+            # Child: render the request and leave without returning into the loop.
+            # STDOUT is reserved for the status lines of the zygote, so anything
+            # the child prints (e.g. for --help) goes to STDERR instead.
+            os.dup2(2, 1)
+            # A hanging request must not block the requests behind it, so
+            # the child is terminated by SIGALRM when the deadline passes.
+            signal.alarm(options.zygote_timeout)
+            code = 1
+            try:
+                code = _zygote_request(parser, options, shlex.split(line))
+            except SystemExit, e:
+                if e.code is None or isinstance(e.code, int):
+                    code = e.code or 0
+            except Exception, e:
+                logger.exception("zygote: %s" % e)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        (pid, result) = os.waitpid(pid, 0)
+        if os.WIFSIGNALED(result):
+            # Report like a shell does
+            code = 128 + os.WTERMSIG(result)
+            logger.error("zygote: request '%s' killed by signal %d" % (line, os.WTERMSIG(result)))
+        else:
+            code = os.WEXITSTATUS(result)
+        if code != 0:
+            logger.error("zygote: request '%s' failed with status %d" % (line, code))
+            status = 1
+        print "%d %s" % (code, line)
+        sys.stdout.flush()
+    return status
+
+def _zygote_request(parser, defaults, args):
+    """Parses the arguments of a single zygote request and renders it."""
+    parser.set_defaults(**defaults.__dict__)
+    (options,args) = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("incorrect number of arguments")
+    if options.change_index and options.output is None:
+        parser.error("option --change-index requires -o")
+    if options.output is None:
+        parser.error("option -o is required for zygote requests")
+    if options.xvfb:
+        parser.error("option -x is not supported for zygote requests")
+    if options.logfile != defaults.logfile:
+        parser.error("option --log is not supported for zygote requests")
+    options.url = args[0]
+    return _render(options)
+
+def _render(options):
+    """Renders options.url into options.output using a new QApplication."""
+    from PyQt4.QtCore import QTimer, qVersion
+    from PyQt4.QtGui import QApplication
+    from PyQt4.QtNetwork import QNetworkProxy
+    from PyQt4.QtWebKit import QWebSettings
+    from webkit2png import WebkitRenderer, ChangeIndex
+
+    # Enable HTTP proxy
+    if 'http_proxy' in os.environ:
+        proxy_url = urlparse.urlparse(os.environ.get('http_proxy'))
+        proxy = QNetworkProxy(QNetworkProxy.HttpProxy, proxy_url.hostname, proxy_url.port)
+        QNetworkProxy.setApplicationProxy(proxy)
+
+    # Enable output of debugging information
+    if options.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # Prepare output ("1" means STDOUT). With --change-index an existing
+    # file is not truncated, so that it is kept if the page has not changed.
+    # A missing file is always written.
+    index = None
+    outputMissing = False
+    if options.change_index:
+        try:
+            index = ChangeIndex(options.change_index)
+        except EnvironmentError, e:
+            logger.error("main: %s" % e)
+            print >> sys.stderr, e
+            return 1
     if options.output is None:
         options.output = sys.stdout
+    elif index is not None and os.path.exists(options.output):
+        options.output = open(options.output, "r+")
     else:
+        outputMissing = True
         options.output = open(options.output, "w")
 
     logger.debug("Version %s, Python %s, Qt %s", VERSION, sys.version, qVersion());
@@ -200,10 +325,31 @@ def main():
                 if "plugins" in options.features:
                     renderer.qWebSettings[QWebSettings.PluginsEnabled] = True
 
-            renderer.render_to_file(res=options.url, file_object=options.output)
-            options.output.close()
+            if index is not None:
+                renderer.changeIndex = index
+                renderer.changeTarget = os.path.abspath(options.output.name)
+                if outputMissing:
+                    index.forget(renderer.change_key(options.url))
+                data = renderer.render_to_bytes(res=options.url)
+                if data is None:
+                    logger.debug("No changes on %s, output not written" % options.url)
+                else:
+                    options.output.truncate(0)
+                    options.output.write(data)
+                options.output.close()
+                index.record(renderer.change_key(options.url))
+
+                # Report the result for scripts that process changes only
+                box = renderer.changeBox
+                if box is None:
+                    print >> sys.stderr, "unchanged"
+                else:
+                    print >> sys.stderr, "changed %d %d %d %d" % (box.x(), box.y(), box.width(), box.height())
+            else:
+                renderer.render_to_file(res=options.url, file_object=options.output)
+                options.output.close()
             QApplication.exit(0)
-        except RuntimeError, e:
+        except (RuntimeError, EnvironmentError, ValueError), e:
             logger.error("main: %s" % e)
             print >> sys.stderr, e
             QApplication.exit(1)
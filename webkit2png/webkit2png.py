@@ -25,6 +25,10 @@
 
 import time
 import os
+import json
+import zlib
+import errno
+import tempfile
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
@@ -74,6 +78,16 @@ class WebkitRenderer(QObject):
         self.encodedUrl = kwargs.get('encodedUrl', False)
         self.cookies = kwargs.get('cookies', [])
 
+        # Set this to a ChangeIndex instance to skip encoding of
+        # screenshots that did not change since the last capture.
+        # 'changeTarget' names the file the image is stored in, so
+        # that captures into different files are compared separately.
+        # After each render 'changeBox' is the QRect of the changed
+        # area, or None if the page has not changed.
+        self.changeIndex = kwargs.get('changeIndex', None)
+        self.changeTarget = kwargs.get('changeTarget', None)
+        self.changeBox = None
+
         # Set some default options for QWebPage
         self.qWebSettings = {
             QWebSettings.JavascriptEnabled : False,
@@ -99,28 +113,219 @@ class WebkitRenderer(QObject):
         # before the data has been used.
         image.helper = helper
 
+        # Compare against the previous capture of this resource. The
+        # bounding box of the changed area (or None) is bound to the image.
+        # The index is only updated by ChangeIndex.record(), once the
+        # image has been stored.
+        if self.changeIndex is not None:
+            image.changeKey = self.change_key(res)
+            image.changeBox = self.changeIndex.compare(image.changeKey, image)
+            self.changeBox = image.changeBox
+            if self.logger: self.logger.debug("Changed area: %s", image.changeBox)
+
         return image
 
+    def change_key(self, res):
+        """
+        Returns the key of the given resource in 'changeIndex'. Besides
+        the URL it contains 'changeTarget' and the options that affect
+        the resulting image.
+        """
+        return json.dumps([_resource_url(res), self.changeTarget, self.format,
+                           self.width, self.height, self.scaleToWidth, self.scaleToHeight,
+                           self.scaleRatio, self.grabWholeWindow, self.renderTransparentBackground])
+
     def render_to_file(self, res, file_object):
         """
         Renders the image into a File resource.
         Returns the size of the data that has been written.
+        If 'changeIndex' is set and the page has not changed
+        nothing is written and 0 is returned.
         """
         format = self.format # this may not be constant due to processEvents()
         image = self.render(res)
+        if self.changeIndex is not None and image.changeBox is None:
+            if self.logger: self.logger.debug("No changes on %s, skipping output" % (res,))
+            self.changeIndex.record(image.changeKey)
+            return 0
         qBuffer = QBuffer()
         image.save(qBuffer, format)
         file_object.write(qBuffer.buffer().data())
+        if self.changeIndex is not None:
+            self.changeIndex.record(image.changeKey)
         return qBuffer.size()
 
     def render_to_bytes(self, res):
-        """Renders the image into an object of type 'str'"""
+        """
+        Renders the image into an object of type 'str'.
+        Returns None if 'changeIndex' is set and the page has not changed.
+        The caller has to call changeIndex.record(change_key(res)) once
+        the data has been stored.
+        """
         format = self.format # this may not be constant due to processEvents()
         image = self.render(res)
+        if self.changeIndex is not None and image.changeBox is None:
+            if self.logger: self.logger.debug("No changes on %s, skipping output" % (res,))
+            return None
         qBuffer = QBuffer()
         image.save(qBuffer, format)
         return qBuffer.buffer().data()
 
+def _resource_url(res):
+    """
+    Returns the URL of a resource as accepted by render(), which
+    is either an URL or a tuple of HTML code and base URL.
+    """
+    if type(res) == tuple:
+        return res[1]
+    return res
+
+class ChangeIndex(object):
+    """
+    Stores a block hash of the last capture of each URL in a JSON file,
+    so that unchanged screenshots can be detected before they are encoded.
+
+    The image is split into squares of 'blockSize' pixels and a CRC32
+    is calculated for every square. Each entry also records the
+    bounding box of the last change as [x, y, width, height], which
+    may be read by other tools. The keys written by WebkitRenderer
+    are JSON lists starting with the URL.
+
+    compare() does not modify the index. Call record() once the image
+    has been stored, so that a failed write is detected as a change
+    on the next run. A damaged index file is read as an empty index.
+    """
+    def __init__(self, filename, blockSize=32):
+        self.filename = filename
+        self.blockSize = blockSize
+        self.entries = self._load()
+        self._pending = {}
+        self._recorded = set()
+
+    def compare(self, key, qImage):
+        """
+        Compares the image with the last recorded capture of 'key'
+        (see WebkitRenderer.change_key()). Returns None if the image has
+        not changed, otherwise a QRect enclosing all changed blocks.
+        The whole image is returned if there is no previous capture.
+        """
+        if isinstance(qImage, QPixmap):
+            qImage = qImage.toImage()
+        image = qImage.convertToFormat(QImage.Format_ARGB32)
+        width, height = image.width(), image.height()
+        hashes = self._block_hashes(image)
+
+        old = self.entries.get(key)
+        box = None
+        if not old or old['size'] != [width, height] or old['blockSize'] != self.blockSize:
+            box = QRect(0, 0, width, height)
+            changed = []
+        else:
+            changed = [i for i, (a, b) in enumerate(zip(old['hashes'], hashes)) if a != b]
+
+        if changed:
+            cols = (width + self.blockSize - 1) // self.blockSize
+            rows = [i // cols for i in changed]
+            columns = [i % cols for i in changed]
+            box = QRect(min(columns) * self.blockSize, min(rows) * self.blockSize,
+                        (max(columns) - min(columns) + 1) * self.blockSize,
+                        (max(rows) - min(rows) + 1) * self.blockSize)
+            box = box.intersected(QRect(0, 0, width, height))
+
+        self._pending[key] = {
+            'size': [width, height],
+            'blockSize': self.blockSize,
+            'hashes': hashes,
+            'box': None,
+        }
+        if box is not None:
+            self._pending[key]['box'] = [box.x(), box.y(), box.width(), box.height()]
+        else:
+            self._pending[key]['box'] = old['box']
+        return box
+
+    def record(self, key):
+        """
+        Stores the last image passed to compare() for 'key' as
+        its new capture and writes the index.
+        """
+        self.entries[key] = self._pending.pop(key)
+        self._recorded.add(key)
+        self.save()
+
+    def forget(self, key):
+        """Removes 'key', so that its next capture is handled as a change."""
+        self.entries.pop(key, None)
+
+    def save(self):
+        """
+        Writes the index back into its file. Entries which have been saved
+        by other processes in the meantime are kept, unless they have been
+        recorded here as well. The file is replaced by renaming a temporary
+        file, so that readers never see a partially written index.
+        """
+        entries = self._load()
+        for key in self._recorded:
+            entries[key] = self.entries[key]
+
+        (fd, tmpname) = tempfile.mkstemp(prefix='.webkit2png-',
+            dir=os.path.dirname(os.path.abspath(self.filename)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmpname, self.filename)
+        except:
+            os.remove(tmpname)
+            raise
+        self.entries = entries
+
+    def _load(self):
+        """
+        Reads the entries from the index file. Returns an empty
+        index if the file does not exist or is damaged.
+        """
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+        except ValueError:
+            return {}
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def _block_hashes(self, image):
+        """
+        Returns the CRC32 of every block of an ARGB32 image,
+        row by row from the top left corner.
+        """
+        size = self.blockSize
+        width, height = image.width(), image.height()
+        cols = (width + size - 1) // size
+        rows = (height + size - 1) // size
+        hashes = [0] * (cols * rows)
+        if not hashes:
+            return hashes
+
+        stride = image.bytesPerLine()
+        ptr = image.constBits()
+        ptr.setsize(image.byteCount())
+        data = ptr.asstring()
+
+        # Feed each scanline segment into the running CRC of its block
+        for y in xrange(height):
+            lineStart = y * stride
+            lineEnd = lineStart + width * 4
+            base = (y // size) * cols
+            for c in xrange(cols):
+                start = lineStart + c * size * 4
+                end = min(start + size * 4, lineEnd)
+                hashes[base + c] = zlib.crc32(data[start:end], hashes[base + c])
+        return hashes
+
 ## @brief The CookieJar class inherits QNetworkCookieJar to make a couple of functions public.
 class CookieJar(QNetworkCookieJar):
 	def __init__(self, cookies, qtUrl, parent=None):
@@ -270,10 +475,7 @@ class _WebkitRendererHelper(QObject):
         # setting the base URL for the interpreted HTML code.
         # When resource is of type str or unicode, it is handled as URL which
         # shal be loaded
-        if type(res) == tuple:
-            url = res[1]
-        else:
-            url = res
+        url = _resource_url(res)
 
         if self.encodedUrl:
             qtUrl = QUrl.fromEncoded(url)